@@ -10,8 +10,13 @@ LLAMA_SERVER_BIN="${LLAMA_SERVER_BIN:-${LLAMA_BIN%/*}/llama-server}"  # defaults
 MODEL_PATH="${MODEL_PATH:?MODEL_PATH not set}"
 PORT="${LLAMA_SERVER_PORT:-8081}"
 HOST="${LLAMA_SERVER_HOST:-127.0.0.1}"
-THREADS="${MODEL_THREADS:-4}"
-CTX="${MODEL_CTX:-4096}"
+NPROC="$(nproc 2>/dev/null || echo 4)"
+THREADS="${MODEL_THREADS:-$(( NPROC > 16 ? 16 : NPROC ))}"
+PARALLEL="${LLAMA_PARALLEL:-8}"          # concurrent slots (continuous batching)
+SLOT_CTX="${MODEL_CTX:-2048}"            # context per slot; total = SLOT_CTX * PARALLEL
+BATCH="${MODEL_BATCH:-2048}"
+UBATCH="${MODEL_UBATCH:-512}"
+GPU_LAYERS="${MODEL_GPU_LAYERS:-0}"
 
 LOG_DIR="$DIR/logs"; mkdir -p "$LOG_DIR"
 PIDFILE="$DIR/.llama_server.pid"
@@ -23,11 +28,12 @@ start(){
   if is_running; then echo "✅ llama-server already running (PID $(cat "$PIDFILE"))"; exit 0; fi
   [[ -x "$LLAMA_SERVER_BIN" ]] || { echo "❌ Not found: $LLAMA_SERVER_BIN"; exit 1; }
   [[ -r "$MODEL_PATH" ]] || { echo "❌ MODEL_PATH not readable: $MODEL_PATH"; exit 1; }
-  echo "▶ Starting llama-server on http://$HOST:$PORT ..."
+  echo "▶ Starting llama-server on http://$HOST:$PORT ($PARALLEL slots x $SLOT_CTX ctx) ..."
   nohup "$LLAMA_SERVER_BIN" \
-    -m "$MODEL_PATH" -t "$THREADS" -c "$CTX" \
+    -m "$MODEL_PATH" -t "$THREADS" -c "$(( SLOT_CTX * PARALLEL ))" \
+    -b "$BATCH" -ub "$UBATCH" -ngl "$GPU_LAYERS" \
     --host "$HOST" --port "$PORT" \
-    --parallel 2 --cont-batching \
+    --parallel "$PARALLEL" --cont-batching \
     --timeout 600000 \
     >>"$LOGFILE" 2>&1 &
   echo $! > "$PIDFILE"
@@ -12,6 +12,7 @@
 #   ./llm.sh test       # GET /chat?q=hi
 #
 # Notes:
+# - Proxies to llama-server (./llama-server.sh start) unless LLAMA_SERVER_URL="".
 # - Reads .env (LLAMA_BIN, MODEL_PATH, etc). Sets safe defaults if missing:
 #     LLAMA_TIMEOUT=600, LLAMA_WARMUP=1
 # - Uses venv at ./venv. Exits with a helpful hint if not found.
@@ -55,6 +56,8 @@ load_env() {
 }
 
 check_llama_vars() {
+  # server mode (default): the model lives in llama-server.sh, nothing to check here
+  [[ -n "${LLAMA_SERVER_URL-http://127.0.0.1:8081}" ]] && return 0
   [[ -n "${LLAMA_BIN:-}" ]] || die "LLAMA_BIN is not set (from .env)."
   [[ -n "${MODEL_PATH:-}" ]] || die "MODEL_PATH is not set (from .env)."
   [[ -x "$LLAMA_BIN" ]] || die "LLAMA_BIN is not executable: $LLAMA_BIN"
@@ -78,9 +81,14 @@ start_prod() {
   load_env
   check_llama_vars
 
-  note "Starting FastAPI (prod) on http://$HOST:$PORT ..."
-  # Run in background with nohup; write PID
-  nohup "${UVICORN_CMD[@]}" "$APP" --host "$HOST" --port "$PORT" \
+  # several workers share llama-server; subprocess mode loads a model per worker, so keep 1
+  local workers=1
+  [[ -n "${LLAMA_SERVER_URL-http://127.0.0.1:8081}" ]] && workers=4
+  workers="${WEB_WORKERS:-$workers}"
+
+  note "Starting FastAPI (prod) on http://$HOST:$PORT with $workers worker(s) ..."
+  # Run in background with nohup; write PID (uvloop/httptools are used when installed)
+  nohup "${UVICORN_CMD[@]}" "$APP" --host "$HOST" --port "$PORT" --workers "$workers" \
     >>"$LOGFILE" 2>&1 &
   echo $! > "$PIDFILE"
   note "PID $(cat "$PIDFILE") — logs: $LOGFILE"
@@ -174,6 +182,7 @@ llm.sh — commands:
   test       Call /chat?q=hi
 Environment:
   HOST (default 0.0.0.0), PORT (default 8000)
+  WEB_WORKERS (default 4 with llama-server, 1 in subprocess mode)
   Reads .env for LLAMA_BIN, MODEL_PATH, etc.
 EOF
     ;;
@@ -0,0 +1,125 @@
+# Path: llm_cache.py
+# Version: 1.1.0
+# Purpose: LLM response cache shared by server.py and whatsapp_llm_gateway.py
+# Notes:
+# - Exact tier: in-process TTL LRU (cachetools) keyed by a blake2b digest of the prompt;
+#   checked first, per worker process. Prompts that look like they carry a timestamp,
+#   epoch or UUID bypass it.
+# - Semantic tier: RedisVL SemanticCache, enabled when SEMANTIC_CACHE_REDIS_URL is set
+#   and redisvl is installed; built by init() at app startup, otherwise lookups are no-ops.
+#   Setup and embedding run in worker threads, never on the event loop.
+# - Entries are namespaced by a tag ("ns"), e.g. language hint + token cap.
+# - Best-effort: cache errors are logged and swallowed, never surfaced to callers.
+
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+try:
+    from cachetools import TTLCache
+except ImportError:
+    TTLCache = None
+
+EXACT_CACHE_SIZE          = int(os.getenv("EXACT_CACHE_SIZE", "2048"))   # 0 disables
+EXACT_CACHE_TTL           = int(os.getenv("EXACT_CACHE_TTL", "300"))
+SEMANTIC_CACHE_REDIS_URL  = os.getenv("SEMANTIC_CACHE_REDIS_URL", "").strip()
+SEMANTIC_CACHE_THRESHOLD  = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.1"))
+SEMANTIC_CACHE_TTL        = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_MODEL      = os.getenv("SEMANTIC_CACHE_MODEL", "redis/langcache-embed-v2")
+
+log = logging.getLogger("uvicorn")
+
+_exact = TTLCache(maxsize=EXACT_CACHE_SIZE, ttl=EXACT_CACHE_TTL) if TTLCache and EXACT_CACHE_SIZE > 0 else None
+EXACT_CACHE_ENABLED = _exact is not None
+
+# per-call values that would make an exact entry useless (and fill the LRU with one-offs)
+_NONCE_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}"
+    r"|\b\d{10,13}\b"
+    r"|\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b",
+    re.IGNORECASE,
+)
+
+def _exact_key(name: str, prompt: str, ns: str) -> Optional[str]:
+    if _exact is None or _NONCE_RE.search(prompt):
+        return None
+    return hashlib.blake2b(f"{name}\0{ns}\0{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+
+_caches: Dict[str, object] = {}
+_vectorizer = None
+
+def _build(names: Tuple[str, ...]) -> None:
+    # blocking: Redis connect, index creation, embedding model load (maybe a Hub download)
+    global _vectorizer
+    from redisvl.extensions.cache.llm import SemanticCache
+    from redisvl.utils.vectorize import HFTextVectorizer
+    _vectorizer = HFTextVectorizer(model=SEMANTIC_CACHE_MODEL)
+    for name in names:
+        _caches[name] = SemanticCache(
+            name=name,
+            redis_url=SEMANTIC_CACHE_REDIS_URL,
+            distance_threshold=SEMANTIC_CACHE_THRESHOLD,
+            vectorizer=_vectorizer,
+            ttl=SEMANTIC_CACHE_TTL,
+            filterable_fields=[{"name": "ns", "type": "tag"}],
+        )
+
+async def init(*names: str) -> None:
+    """Build the named semantic caches off the event loop; call from a startup hook."""
+    if not SEMANTIC_CACHE_REDIS_URL:
+        return
+    try:
+        await asyncio.to_thread(_build, names)
+    except Exception as e:
+        log.warning(f"[cache.semantic] disabled: {e}")
+        _caches.clear()
+
+def semantic_enabled() -> bool:
+    return bool(_caches)
+
+async def _embed(prompt: str):
+    # sentence-transformers is CPU-bound and synchronous; keep it off the loop
+    return await asyncio.to_thread(_vectorizer.embed, prompt)
+
+async def lookup(name: str, prompt: str, ns: str, semantic: bool = True) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return (response, tier) for `prompt` in namespace `ns`, tier being "exact" or
+    "semantic"; (None, None) on a miss. semantic=False limits the lookup to exact matches.
+    """
+    key = _exact_key(name, prompt, ns)
+    if key is not None:
+        hit = _exact.get(key)
+        if hit is not None:
+            return hit, "exact"
+    cache = _caches.get(name) if semantic else None
+    if cache is None:
+        return None, None
+    try:
+        from redisvl.query.filter import Tag
+        hits = await cache.acheck(vector=await _embed(prompt), num_results=1, filter_expression=Tag("ns") == ns)
+    except Exception as e:
+        log.warning(f"[cache.semantic] lookup error: {e}")
+        return None, None
+    response = (hits[0].get("response") or None) if hits else None
+    if response is None:
+        return None, None
+    if key is not None:
+        _exact[key] = response
+    return response, "semantic"
+
+async def store(name: str, prompt: str, response: str, ns: str, semantic: bool = True) -> None:
+    if not response:
+        return
+    key = _exact_key(name, prompt, ns)
+    if key is not None:
+        _exact[key] = response
+    cache = _caches.get(name) if semantic else None
+    if cache is None:
+        return
+    try:
+        await cache.astore(prompt=prompt, response=response, vector=await _embed(prompt), filters={"ns": ns})
+    except Exception as e:
+        log.warning(f"[cache.semantic] store error: {e}")
@@ -7,20 +7,39 @@
 # - Echo: reply/response, elapsed_ms, used_tokens, max_tokens_used
 # - Echo: timeout_ms_used + timeout_source ("client"|"default"|"clamped")
 # - ENFORCE: transport timeout = (timeout_ms_used/1000) + 0.5
+# - /chat/stream: same inputs as /chat, SSE out: data: {"content": ...} ... data: {"done": true, ...}
 
 import os
+import re
 import json
 import shlex
-import subprocess
-from typing import Optional, Dict, Any, List
+import shutil
+import signal
+import asyncio
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 
-from fastapi import FastAPI, HTTPException, Query, Body, Request
+import httpx
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
+import llm_cache
+
 from time import perf_counter
 
+# orjson on the hot path when installed (request bodies, llama-server bodies, SSE)
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:
+    _loads = json.loads
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -30,25 +49,50 @@ except Exception:
 # --------------------------------------------------------------------------------------
 # Configuration (env-driven)
 # --------------------------------------------------------------------------------------
-LLAMA_BIN = os.getenv("LLAMA_BIN", "").strip()
-MODEL_PATH = os.getenv("MODEL_PATH", "").strip()
+def _resolve_path(p: str) -> str:
+    return os.path.realpath(os.path.expanduser(p)) if p else ""
+
+def _resolve_bin(p: str) -> str:
+    # a bare command name ("llama-cli") is looked up on PATH, as subprocess would
+    if p and os.sep not in p and not p.startswith("~"):
+        found = shutil.which(p)
+        return os.path.realpath(found) if found else p
+    return _resolve_path(p)
+
+# resolved once at import; the request path never touches the filesystem for these
+LLAMA_BIN = _resolve_bin(os.getenv("LLAMA_BIN", "").strip())
+MODEL_PATH = _resolve_path(os.getenv("MODEL_PATH", "").strip())
 
 # runtime knobs
 MODEL_TOKENS = int(os.getenv("MODEL_TOKENS", "64"))
 MODEL_CTX = int(os.getenv("MODEL_CTX", "2048"))
-MODEL_THREADS = int(os.getenv("MODEL_THREADS", "0") or "0") or None
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "0") or "0") or min(os.cpu_count() or 1, 16)
+MODEL_BATCH = int(os.getenv("MODEL_BATCH", "2048"))    # logical batch (-b)
+MODEL_UBATCH = int(os.getenv("MODEL_UBATCH", "512"))   # physical batch (-ub)
 MODEL_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE", "0.7"))
 MODEL_TOP_P = float(os.getenv("MODEL_TOP_P", "0.95"))
+MODEL_REPEAT_PENALTY = float(os.getenv("MODEL_REPEAT_PENALTY", "1.1"))
 EXTRA_ARGS = os.getenv("LLAMA_EXTRA_ARGS", "").strip()
 TIMEOUT_SEC = int(os.getenv("LLAMA_TIMEOUT", "30"))  # legacy default
+LLAMA_MAX_CONCURRENCY = max(1, int(os.getenv("LLAMA_MAX_CONCURRENCY", "1")))  # subprocess mode: model copies in RAM
 
-# proxy to persistent llama.cpp HTTP server if provided
-LLAMA_SERVER_URL = os.getenv("LLAMA_SERVER_URL", "").rstrip("/")
+# proxy to persistent llama.cpp HTTP server (see llama-server.sh); the model stays
+# loaded across requests. Set LLAMA_SERVER_URL="" to fall back to the legacy
+# one-shot subprocess, which reloads the GGUF on every call.
+LLAMA_SERVER_URL = os.getenv("LLAMA_SERVER_URL", "http://127.0.0.1:8081").strip().rstrip("/")
 
 # Gateway timeout resolver (echo + enforced upstream)
 GATEWAY_DEFAULT_TIMEOUT_MS = int(os.getenv("GATEWAY_DEFAULT_TIMEOUT_MS", str(TIMEOUT_SEC * 1000)))
 GATEWAY_MAX_TIMEOUT_MS     = int(os.getenv("GATEWAY_MAX_TIMEOUT_MS", "60000"))
 
+_LLAMA_SEM = asyncio.Semaphore(LLAMA_MAX_CONCURRENCY)
+
+# llama.cpp CLI stdout noise (ANSI colour/cursor codes, end-of-generation marker),
+# fused into one pattern so the output is scanned once
+_CLI_NOISE_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\[end of text\]")
+_CLI_EOT = b"[end of text]"
+_CLI_MAX_BYTES_PER_TOKEN = 32  # generous; only cuts off a runaway process
+
 # --------------------------------------------------------------------------------------
 # App setup
 # --------------------------------------------------------------------------------------
@@ -65,6 +109,25 @@ app.add_middleware(
 if os.path.isdir("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.on_event("startup")
+async def _startup() -> None:
+    if not LLAMA_SERVER_URL:
+        # subprocess mode: fail fast instead of 500-ing every request
+        if not (LLAMA_BIN and os.access(LLAMA_BIN, os.X_OK)):
+            raise RuntimeError(f"LLAMA_BIN not found/executable: {LLAMA_BIN or '(unset)'}")
+        if not (MODEL_PATH and os.path.isfile(MODEL_PATH)):
+            raise RuntimeError(f"MODEL_PATH not found: {MODEL_PATH or '(unset)'}")
+    await llm_cache.init("docum_llm")
+    # one keep-alive pool to llama-server for the life of the process
+    app.state.llm_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+        timeout=httpx.Timeout(GATEWAY_MAX_TIMEOUT_MS / 1000.0, connect=5.0),
+    )
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await app.state.llm_client.aclose()
+
 # --------------------------------------------------------------------------------------
 # Helpers
 # --------------------------------------------------------------------------------------
@@ -72,16 +135,11 @@ def _clamp_tokens(req_cap: Optional[int]) -> int:
     if not req_cap:
         return MODEL_TOKENS
     try:
-        cap = int(req_cap)
-    except Exception:
-        cap = MODEL_TOKENS
-    if cap < 1:
-        cap = 1
-    if cap > MODEL_TOKENS:
-        cap = MODEL_TOKENS
-    return cap
-
-def _resolve_timeout_ms(d: Dict[str, Any]) -> tuple[int, str]:
+        return min(MODEL_TOKENS, max(1, int(req_cap)))
+    except (TypeError, ValueError, OverflowError):
+        return MODEL_TOKENS
+
+def _resolve_timeout_ms(timeout_ms: Any, timeout: Any) -> tuple[int, str]:
     """
     Return (effective_timeout_ms, source).
     Precedence: timeout_ms (ms) > timeout (sec) > default.
@@ -89,42 +147,23 @@ def _resolve_timeout_ms(d: Dict[str, Any]) -> tuple[int, str]:
     Source is:
       - "client"  if provided by client and NOT reduced by clamping
       - "clamped" if provided by client and WAS reduced
-      - "default" if no client override
+      - "default" if no client override (or it was unparseable)
     """
-    src = "default"
-    t_ms = None
-    requested: Optional[int] = None
-
-    # explicit ms
-    if "timeout_ms" in d and d.get("timeout_ms") is not None:
+    requested = None
+    if timeout_ms is not None:
         try:
-            requested = int(d.get("timeout_ms"))
-            t_ms = requested
-            src = "client"
-        except Exception:
-            t_ms = None
-
-    # seconds
-    if t_ms is None and "timeout" in d and d.get("timeout") is not None:
+            requested = int(timeout_ms)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if requested is None and timeout is not None:
         try:
-            requested = int(float(d.get("timeout")) * 1000.0)
-            t_ms = requested
-            src = "client"
-        except Exception:
-            t_ms = None
-
-    # default
-    if t_ms is None:
-        t_ms = GATEWAY_DEFAULT_TIMEOUT_MS
-        src = "default"
-
-    # clamp to bounds
-    clamped_val = max(1000, min(int(t_ms), GATEWAY_MAX_TIMEOUT_MS))
-    # Only mark "clamped" if we actually reduced a client-supplied value
-    if src == "client" and requested is not None and clamped_val < requested:
-        src = "clamped"
-    t_ms = clamped_val
-    return t_ms, src
+            requested = int(float(timeout) * 1000.0)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    if requested is None:
+        return min(GATEWAY_MAX_TIMEOUT_MS, max(1000, GATEWAY_DEFAULT_TIMEOUT_MS)), "default"
+    clamped = min(GATEWAY_MAX_TIMEOUT_MS, max(1000, requested))
+    return clamped, ("clamped" if clamped < requested else "client")
 
 def build_llama_cmd(prompt: str, n_predict: int) -> List[str]:
     cmd = [
@@ -134,59 +173,100 @@ def build_llama_cmd(prompt: str, n_predict: int) -> List[str]:
         "--ctx-size", str(MODEL_CTX),
         "--temp", str(MODEL_TEMPERATURE),
         "--top-p", str(MODEL_TOP_P),
+        "-b", str(MODEL_BATCH),
+        "-ub", str(MODEL_UBATCH),
+        "-t", str(MODEL_THREADS),
     ]
-    if MODEL_THREADS and MODEL_THREADS > 0:
-        cmd += ["-t", str(MODEL_THREADS)]
     if EXTRA_ARGS:
         cmd += shlex.split(EXTRA_ARGS)
     return cmd
 
-def call_llama_subprocess(prompt: str, n_predict: int, timeout_s: float) -> str:
-    if not LLAMA_BIN or not MODEL_PATH:
-        raise HTTPException(500, "LLAMA_BIN/MODEL_PATH not set and no LLAMA_SERVER_URL provided.")
+def _kill_group(proc: asyncio.subprocess.Process) -> None:
+    # whole process group, so a wrapper script's children don't keep our pipes open
     try:
-        proc = subprocess.run(
-            build_llama_cmd(prompt, n_predict),
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            check=False, text=True, timeout=timeout_s,
-        )
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=504, detail="LLM timed out (subprocess).")
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="LLAMA_BIN not found/executable.")
-    out = (proc.stdout or "").strip()
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def call_llama_subprocess(prompt: str, n_predict: int, timeout_s: float) -> str:
+    # each llama.cpp process loads its own copy of the model; queue beyond what RAM can hold
+    async with _LLAMA_SEM:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *build_llama_cmd(prompt, n_predict),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                limit=1 << 20, start_new_session=True,
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=500, detail="LLAMA_BIN not found/executable.")
+        # drain stderr alongside stdout, or llama.cpp's logging can fill the pipe and stall it
+        err_task = asyncio.ensure_future(proc.stderr.read())
+        chunks: List[bytes] = []
+        # stdout echoes the prompt, then the generation
+        byte_cap = len(prompt.encode("utf-8")) + n_predict * _CLI_MAX_BYTES_PER_TOKEN
+
+        async def _read_until_done() -> bool:
+            size = 0
+            async for line in proc.stdout:
+                chunks.append(line)
+                size += len(line)
+                if _CLI_EOT in line or size > byte_cap:
+                    # answer is complete; skip llama.cpp's perf dump and teardown
+                    _kill_group(proc)
+                    return True
+            return False
+
+        try:
+            stopped_early = await asyncio.wait_for(_read_until_done(), timeout=timeout_s)
+            await proc.wait()
+        except asyncio.TimeoutError:
+            _kill_group(proc)
+            await proc.wait()
+            err_task.cancel()
+            raise HTTPException(status_code=504, detail="LLM timed out (subprocess).")
+        except asyncio.CancelledError:
+            # no caller left waiting (see call_llama); don't leave the model running
+            _kill_group(proc)
+            err_task.cancel()
+            raise
+        if stopped_early:
+            err_task.cancel()
+            stderr = b""
+        else:
+            stderr = await err_task
+    out = _CLI_NOISE_RE.sub("", b"".join(chunks).decode(errors="replace")).strip()
     if proc.returncode != 0 and not out:
-        err = (proc.stderr or "Unknown llama.cpp error").strip()
+        err = (stderr.decode(errors="replace") or "Unknown llama.cpp error").strip()
         raise HTTPException(status_code=500, detail=f"LLM error: {err}")
     return out
 
-def call_llama_server(prompt: str, n_predict: int, timeout_s: float) -> str:
-    import urllib.request, urllib.error
-    payload = {
+def _completion_payload(prompt: str, n_predict: int, stream: bool) -> Dict[str, Any]:
+    return {
         "prompt": prompt,
         "n_predict": n_predict,
         "temperature": MODEL_TEMPERATURE,
         "top_p": MODEL_TOP_P,
+        "repeat_penalty": MODEL_REPEAT_PENALTY,
         "cache_prompt": True,
+        "stream": stream,
     }
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        f"{LLAMA_SERVER_URL}/completion",
-        data=data, headers={"Content-Type": "application/json"},
-    )
+
+async def call_llama_server(prompt: str, n_predict: int, timeout_s: float) -> str:
+    payload = _completion_payload(prompt, n_predict, stream=False)
     try:
-        with urllib.request.urlopen(req, timeout=timeout_s) as resp:
-            body = resp.read().decode("utf-8")
-            j = json.loads(body)
-    except urllib.error.HTTPError as e:
-        try:
-            err_body = e.read().decode(errors="ignore")
-        except Exception:
-            err_body = ""
-        raise HTTPException(e.code, f"Model server HTTP error: {err_body[:200]}")
-    except Exception as e:
-        # Could be a timeout or connectivity; preserve legacy 502 for now
+        resp = await app.state.llm_client.post(
+            f"{LLAMA_SERVER_URL}/completion", content=_dumps(payload), headers=_JSON_HEADERS, timeout=timeout_s,
+        )
+        resp.raise_for_status()
+        j = _loads(resp.content)
+    except httpx.TimeoutException:
+        raise HTTPException(504, "LLM timed out (server).")
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(e.response.status_code, f"Model server HTTP error: {e.response.text[:200]}")
+    except httpx.HTTPError as e:
         raise HTTPException(502, f"Model server unreachable: {e}")
+    except ValueError:
+        raise HTTPException(502, "Model server returned invalid JSON.")
 
     for key in ("content", "response"):
         if key in j and isinstance(j[key], str):
@@ -199,11 +279,163 @@ def call_llama_server(prompt: str, n_predict: int, timeout_s: float) -> str:
             return c["message"]["content"]
     raise HTTPException(status_code=500, detail="Unexpected model server response.")
 
-def call_llama(prompt: str, n_predict: int, timeout_s: float) -> str:
-    if not prompt or not prompt.strip():
+async def stream_llama_server(prompt: str, n_predict: int, timeout_s: float) -> AsyncIterator[str]:
+    """
+    Open a streaming /completion and return an iterator of content pieces.
+    Upstream errors raise here, before the first byte goes to the client.
+    Closing the iterator early (client went away) closes the upstream
+    connection, which frees the llama-server slot.
+    """
+    cli: httpx.AsyncClient = app.state.llm_client
+    req = cli.build_request(
+        "POST", f"{LLAMA_SERVER_URL}/completion",
+        content=_dumps(_completion_payload(prompt, n_predict, stream=True)), headers=_JSON_HEADERS, timeout=timeout_s,
+    )
+    try:
+        resp = await cli.send(req, stream=True)
+    except httpx.TimeoutException:
+        raise HTTPException(504, "LLM timed out (server).")
+    except httpx.HTTPError as e:
+        raise HTTPException(502, f"Model server unreachable: {e}")
+    if resp.status_code != 200:
+        body = (await resp.aread()).decode(errors="ignore")
+        await resp.aclose()
+        raise HTTPException(resp.status_code, f"Model server HTTP error: {body[:200]}")
+
+    async def pieces() -> AsyncIterator[str]:
+        deadline = perf_counter() + timeout_s
+        try:
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                j = _loads(line[6:])
+                if j.get("content"):
+                    yield j["content"]
+                if j.get("stop"):
+                    break
+                if perf_counter() > deadline:
+                    raise httpx.TimeoutException("LLM timed out (server).")
+        finally:
+            await resp.aclose()
+    return pieces()
+
+# Single-flight: identical (n_predict, prompt) calls already in flight share one upstream call.
+# The shared call runs on the gateway's max budget; each caller waits only its own timeout_s,
+# and the call is cancelled once no caller is left waiting on it.
+_inflight: Dict[Tuple[int, str], "asyncio.Task[str]"] = {}
+_waiters: Dict[Tuple[int, str], int] = {}
+_UPSTREAM_TIMEOUT_S = (GATEWAY_MAX_TIMEOUT_MS / 1000.0) + 0.5
+
+async def _call_llama_upstream(prompt: str, n_predict: int, timeout_s: float) -> str:
+    if LLAMA_SERVER_URL:
+        return await call_llama_server(prompt, n_predict, timeout_s)
+    return await call_llama_subprocess(prompt, n_predict, timeout_s)
+
+async def call_llama(prompt: str, n_predict: int, timeout_s: float) -> str:
+    # handlers already strip; only pay for another copy when there is edge whitespace
+    if prompt[:1].isspace() or prompt[-1:].isspace():
+        prompt = prompt.strip()
+    if not prompt:
         raise HTTPException(status_code=422, detail="Prompt is empty.")
-    prompt = prompt.strip()
-    return call_llama_server(prompt, n_predict, timeout_s) if LLAMA_SERVER_URL else call_llama_subprocess(prompt, n_predict, timeout_s)
+    key = (n_predict, prompt)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_call_llama_upstream(prompt, n_predict, _UPSTREAM_TIMEOUT_S))
+        _inflight[key] = task
+
+        def _forget(t: "asyncio.Task[str]") -> None:
+            if _inflight.get(key) is t:
+                del _inflight[key]
+            if not t.cancelled():
+                t.exception()  # mark retrieved even if every waiter went away
+        task.add_done_callback(_forget)
+    _waiters[key] = _waiters.get(key, 0) + 1
+    try:
+        # shield: one caller disconnecting or timing out must not cancel the call the
+        # others are waiting on; wait_for: each caller still gets its own transport budget
+        return await asyncio.wait_for(asyncio.shield(task), timeout_s)
+    except asyncio.TimeoutError:
+        raise HTTPException(504, "LLM timed out (server).")
+    finally:
+        _waiters[key] -= 1
+        if not _waiters[key]:
+            del _waiters[key]
+            if not task.done():
+                task.cancel()  # last waiter gone; free the llama-server slot / subprocess
+
+def _semantic_ok(text: str) -> bool:
+    # Semantic matching only for raw single-line user prompts. Templated prompts (e.g. the
+    # WhatsApp worker's policy + CONTEXT + QUESTION) are mostly shared boilerplate, so two
+    # different questions would embed close together; those get exact matching only.
+    return "\n" not in text
+
+async def _answer(text: str, n_tokens: int, t_ms: int, t_src: str) -> JSONResponse:
+    # cache namespace = token cap, so a short cached reply never answers a longer request
+    ns = str(n_tokens)
+    semantic = _semantic_ok(text)
+    t0 = perf_counter()
+    cached, tier = await llm_cache.lookup("docum_llm", text, ns, semantic)
+    if cached is not None:
+        ans = cached
+    else:
+        timeout_s = (t_ms / 1000.0) + 0.5  # enforce upstream
+        ans = await call_llama(text, n_tokens, timeout_s)
+        await llm_cache.store("docum_llm", text, ans, ns, semantic)
+    elapsed_ms = int((perf_counter() - t0) * 1000)
+    return JSONResponse({
+        "reply": ans,
+        "response": ans,
+        "elapsed_ms": elapsed_ms,
+        "used_tokens": n_tokens,
+        "max_tokens_used": n_tokens,
+        "timeout_ms_used": t_ms,
+        "timeout_source": t_src,
+        "cache": tier,
+    })
+
+def _sse(obj: Dict[str, Any]) -> bytes:
+    return b"data: " + _dumps(obj) + b"\n\n"
+
+async def _answer_stream(text: str, n_tokens: int, t_ms: int, t_src: str) -> StreamingResponse:
+    ns = str(n_tokens)
+    semantic = _semantic_ok(text)
+    t0 = perf_counter()
+    timeout_s = (t_ms / 1000.0) + 0.5  # enforce upstream
+    whole, tier = await llm_cache.lookup("docum_llm", text, ns, semantic)
+    pieces = None
+    if whole is None:
+        if LLAMA_SERVER_URL:
+            pieces = await stream_llama_server(text, n_tokens, timeout_s)
+        else:
+            # subprocess mode has no token stream; send the whole answer as one piece
+            whole = await call_llama(text, n_tokens, timeout_s)
+            await llm_cache.store("docum_llm", text, whole, ns, semantic)
+
+    async def events() -> AsyncIterator[bytes]:
+        if pieces is None:
+            yield _sse({"content": whole})
+        else:
+            buf: List[str] = []
+            try:
+                async for piece in pieces:
+                    buf.append(piece)
+                    yield _sse({"content": piece})
+            except (httpx.HTTPError, ValueError) as e:
+                # headers are already sent; report in-band and don't cache the partial answer
+                yield _sse({"error": f"Model server stream error: {e}"})
+            else:
+                await llm_cache.store("docum_llm", text, "".join(buf), ns, semantic)
+        yield _sse({
+            "done": True,
+            "elapsed_ms": int((perf_counter() - t0) * 1000),
+            "used_tokens": n_tokens,
+            "max_tokens_used": n_tokens,
+            "timeout_ms_used": t_ms,
+            "timeout_source": t_src,
+            "cache": tier,
+        })
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # --------------------------------------------------------------------------------------
 # Routes
@@ -216,65 +448,55 @@ def root() -> Dict[str, Any]:
 def healthz() -> str:
     return "ok"
 
-# GET /chat  (accepts ?prompt= or ?q=)
+# GET /chat  (accepts ?prompt= or ?q=); /chat/stream takes the same inputs and answers via SSE
 @app.get("/chat")
-def chat_get(
+@app.get("/chat/stream")
+async def chat_get(
     request: Request,
     prompt: Optional[str] = Query(None),
     q: Optional[str] = Query(None),
     max_tokens: Optional[int] = Query(None),
     n_predict: Optional[int] = Query(None),
-) -> JSONResponse:
+    # raw strings: _resolve_timeout_ms parses them and falls back to the default if malformed
+    timeout_ms: Optional[str] = Query(None),
+    timeout: Optional[str] = Query(None),
+):
     text = (prompt or q or "").strip()
     if not text:
         raise HTTPException(status_code=422, detail="Missing 'prompt' (or 'q') parameter")
     tokens_req = max_tokens or n_predict
     n_tokens = _clamp_tokens(tokens_req)
 
-    merged = dict(request.query_params)
-    t_ms, t_src = _resolve_timeout_ms(merged)
-    timeout_s = (t_ms / 1000.0) + 0.5  # enforce upstream
-
-    t0 = perf_counter()
-    ans = call_llama(text, n_tokens, timeout_s)
-    elapsed_ms = int((perf_counter() - t0) * 1000)
-    return JSONResponse({
-        "reply": ans,
-        "response": ans,
-        "elapsed_ms": elapsed_ms,
-        "used_tokens": n_tokens,
-        "max_tokens_used": n_tokens,
-        "timeout_ms_used": t_ms,
-        "timeout_source": t_src,
-    })
+    t_ms, t_src = _resolve_timeout_ms(timeout_ms, timeout)
+    if request.url.path.endswith("/stream"):
+        return await _answer_stream(text, n_tokens, t_ms, t_src)
+    return await _answer(text, n_tokens, t_ms, t_src)
 
-# POST /chat
+# POST /chat, /chat/stream
 @app.post("/chat")
-def chat_post(request: Request, payload: Dict[str, Any] = Body(...)) -> JSONResponse:
-    text = ((payload or {}).get("prompt") or "").strip()
+@app.post("/chat/stream")
+async def chat_post(request: Request):
+    try:
+        payload = _loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Body must be valid JSON.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Body must be a JSON object.")
+    text = (payload.get("prompt") or "").strip()
     if not text:
         raise HTTPException(status_code=422, detail="Body must include 'prompt'.")
-    tokens_req = (payload or {}).get("max_tokens") or (payload or {}).get("n_predict")
+    tokens_req = payload.get("max_tokens") or payload.get("n_predict")
     n_tokens = _clamp_tokens(tokens_req)
 
-    merged = dict(request.query_params)
-    if isinstance(payload, dict):
-        merged.update(payload)
-    t_ms, t_src = _resolve_timeout_ms(merged)
-    timeout_s = (t_ms / 1000.0) + 0.5  # enforce upstream
-
-    t0 = perf_counter()
-    ans = call_llama(text, n_tokens, timeout_s)
-    elapsed_ms = int((perf_counter() - t0) * 1000)
-    return JSONResponse({
-        "reply": ans,
-        "response": ans,
-        "elapsed_ms": elapsed_ms,
-        "used_tokens": n_tokens,
-        "max_tokens_used": n_tokens,
-        "timeout_ms_used": t_ms,
-        "timeout_source": t_src,
-    })
+    # body wins; query string kept as a fallback for clients that send ?timeout_ms= on POST
+    qp = request.query_params
+    t_ms, t_src = _resolve_timeout_ms(
+        payload.get("timeout_ms", qp.get("timeout_ms")),
+        payload.get("timeout", qp.get("timeout")),
+    )
+    if request.url.path.endswith("/stream"):
+        return await _answer_stream(text, n_tokens, t_ms, t_src)
+    return await _answer(text, n_tokens, t_ms, t_src)
 
 @app.get("/debug/llm")
 def debug_llm() -> Dict[str, Any]:
@@ -286,11 +508,17 @@ def debug_llm() -> Dict[str, Any]:
         "MODEL_TOKENS": MODEL_TOKENS,
         "MODEL_CTX": MODEL_CTX,
         "MODEL_THREADS": MODEL_THREADS,
+        "MODEL_BATCH": MODEL_BATCH,
+        "MODEL_UBATCH": MODEL_UBATCH,
+        "LLAMA_MAX_CONCURRENCY": LLAMA_MAX_CONCURRENCY,
         "temperature": MODEL_TEMPERATURE,
         "top_p": MODEL_TOP_P,
+        "repeat_penalty": MODEL_REPEAT_PENALTY,
         "timeout": TIMEOUT_SEC,  # legacy
         "gateway_default_timeout_ms": GATEWAY_DEFAULT_TIMEOUT_MS,
         "gateway_max_timeout_ms": GATEWAY_MAX_TIMEOUT_MS,
+        "exact_cache": llm_cache.EXACT_CACHE_ENABLED,
+        "semantic_cache": llm_cache.semantic_enabled(),
     }
 
 # --------------------------------------------------------------------------------------
@@ -298,4 +526,15 @@ def debug_llm() -> Dict[str, Any]:
 # --------------------------------------------------------------------------------------
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("server:app", host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
+    # loop/http "auto" pick uvloop + httptools when installed (pip install "uvicorn[standard]").
+    # Several workers share one llama-server; in subprocess mode each worker would load the
+    # model itself, so stay at one there unless WEB_WORKERS says otherwise.
+    uvicorn.run(
+        "server:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_WORKERS", "4" if LLAMA_SERVER_URL else "1")),
+        loop="auto",
+        http="auto",
+        log_level="info",
+    )
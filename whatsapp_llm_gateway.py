@@ -2,12 +2,26 @@
 # Version: 3.4.0-wa.llm (RAG + retries + push preview)
 # WhatsApp LLM Worker: retrieve (DocuMind local) -> generate -> push via Twilio
 
-import os, asyncio, logging
+import os, json, asyncio, logging
+from time import perf_counter
 from typing import Dict, Any, Tuple, Optional, List
 import httpx
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 
+import llm_cache
+
+# orjson for request and upstream bodies when installed
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:
+    _loads = json.loads
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 app = FastAPI(title="WhatsApp LLM Worker (RAG)")
 
 # ---------------- Env ----------------
@@ -16,10 +30,17 @@ WA_MAX_TOKENS      = int(os.getenv("WA_MAX_TOKENS", "48"))
 WA_PERCENT_CAP     = int(os.getenv("WA_PERCENT_CAP", "35"))
 WA_LANG_HINT       = os.getenv("WA_LANG_HINT", "en").lower()
 WA_DEBUG           = os.getenv("WA_DEBUG", "1").lower() in {"1","true","yes","on"}
+# Short questions: if retrieval hasn't answered within WA_SPECULATE_MS, pre-generate the no-context
+# answer so it is ready should retrieval come back empty (it is never used over real context).
+# Streaming mode only: dropping the SSE stream stops the generation, whereas an abandoned
+# non-streaming /chat call keeps its llama-server slot busy until it finishes.
+WA_SPECULATE_MS    = int(os.getenv("WA_SPECULATE_MS", "200"))     # 0 disables
+WA_SPECULATE_WORDS = int(os.getenv("WA_SPECULATE_WORDS", "4"))    # max words for a "short" question
 
 # LLM server (already working with 'prompt' schema)
 LLM_API_URL        = os.getenv("LLM_API_URL", "http://127.0.0.1:8000/chat")
 WA_LLM_SCHEMA      = os.getenv("WA_LLM_SCHEMA", "prompt").lower()  # we use 'prompt'
+WA_LLM_STREAM      = os.getenv("WA_LLM_STREAM", "0").lower() in {"1","true","yes","on"}  # use {LLM_API_URL}/stream
 
 # DocuMind Ask (for retrieval)
 ASK_HTTP_BASE      = os.getenv("ASK_HTTP_BASE", "http://127.0.0.1:9000").rstrip("/")
@@ -31,6 +52,17 @@ TWILIO_SID         = os.getenv("TWILIO_ACCOUNT_SID", "")
 TWILIO_TOKEN       = os.getenv("TWILIO_AUTH_TOKEN", "")
 TWILIO_FROM        = os.getenv("TWILIO_FROM", os.getenv("TWILIO_WHATSAPP_NUMBER", ""))
 
+# Shared HTTP pools (created on startup; one handshake per upstream, not per call)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE   = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+HTTP_KEEPALIVE_S     = float(os.getenv("HTTP_KEEPALIVE_S", "60"))
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 to Twilio)
+    HTTP2 = True
+except Exception:
+    HTTP2 = False
+
 log = logging.getLogger("uvicorn")
 
 # ---------------- Utilities ----------------
@@ -46,18 +78,47 @@ def _normalize_wa(s: str) -> str:
     return s
 
 def _extract_text(data: Dict[str, Any]) -> str:
-    text = (data.get("reply") or data.get("response") or data.get("text") or "").strip()
-    if not text and isinstance(data.get("choices"), list) and data["choices"]:
-        text = ((data["choices"][0].get("message") or {}).get("content") or "").strip()
-    return text
+    text = data.get("reply") or data.get("response") or data.get("text")
+    if text:
+        return text.strip()
+    choices = data.get("choices")
+    if choices and isinstance(choices, list):
+        msg = choices[0].get("message")
+        if msg:
+            return (msg.get("content") or "").strip()
+    return ""
 
 def _is_retryable(meta: Dict[str, Any]) -> bool:
     err = (meta or {}).get("data", {}).get("error", "")
     e = err.lower()
-    return (" 50" in err) or ("502" in err) or ("bad gateway" in e) or ("timeout" in e)
+    return (" 50" in err) or ("502" in err) or ("bad gateway" in e) or ("timeout" in e) or ("stream error" in e)
+
+# ---------------- HTTP clients ----------------
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_S,
+    )
+
+@app.on_event("startup")
+async def _startup():
+    await llm_cache.init("docum_wa")
+    app.state.llm_client = httpx.AsyncClient(
+        limits=_limits(), timeout=httpx.Timeout(30.0, connect=5.0), http2=HTTP2,
+    )
+    app.state.twilio_client = httpx.AsyncClient(
+        limits=_limits(), timeout=httpx.Timeout(10.0, connect=5.0), http2=HTTP2,
+        auth=(TWILIO_SID, TWILIO_TOKEN),
+    )
+
+@app.on_event("shutdown")
+async def _shutdown():
+    await app.state.llm_client.aclose()
+    await app.state.twilio_client.aclose()
 
 # ---------------- Retrieval (DocuMind local) ----------------
-async def _fetch_local_context(q: str, timeout_ms: int) -> Tuple[str, List[str]]:
+async def _fetch_local_context(cli: httpx.AsyncClient, q: str, timeout_ms: int) -> Tuple[str, List[str]]:
     """Returns (context_text, source_ids[]) or ("", [])."""
     payload = {
         "q": q,
@@ -70,17 +131,16 @@ async def _fetch_local_context(q: str, timeout_ms: int) -> Tuple[str, List[str]]
         "timeout_ms": max(2000, min(6000, timeout_ms - 1500)),
     }
     try:
-        async with httpx.AsyncClient(timeout=(payload["timeout_ms"]/1000.0)+1.0) as cli:
-            r = await cli.post(ASK_ANSWER_URL, json=payload)
-            r.raise_for_status()
-            j = r.json() if r.headers.get("content-type","").startswith("application/json") else {}
-            # We accept several shapes; prefer explicit fields if present
-            ctx = (j.get("context") or j.get("answer") or "").strip()
-            sources = j.get("sources") or j.get("evidence") or []
-            # Normalize sources to a list of short IDs/labels
-            if isinstance(sources, dict): sources = list(sources.values())
-            sources = [str(s)[:80] for s in sources if s]
-            return ctx, sources
+        r = await cli.post(ASK_ANSWER_URL, content=_dumps(payload), headers=_JSON_HEADERS, timeout=(payload["timeout_ms"]/1000.0)+1.0)
+        r.raise_for_status()
+        j = _loads(r.content) if r.headers.get("content-type","").startswith("application/json") else {}
+        # We accept several shapes; prefer explicit fields if present
+        ctx = (j.get("context") or j.get("answer") or "").strip()
+        sources = j.get("sources") or j.get("evidence") or []
+        # Normalize sources to a list of short IDs/labels
+        if isinstance(sources, dict): sources = list(sources.values())
+        sources = [str(s)[:80] for s in sources if s]
+        return ctx, sources
     except Exception as e:
         if WA_DEBUG: log.warning(f"[rag.fetch] error: {e}")
         return "", []
@@ -89,8 +149,8 @@ async def _fetch_local_context(q: str, timeout_ms: int) -> Tuple[str, List[str]]
 async def _call_chat_prompt(cli: httpx.AsyncClient, url: str, prompt: str, max_tokens: int, timeout_ms: int) -> Tuple[bool, str, Dict[str, Any]]:
     body = {"prompt": prompt, "max_tokens": max_tokens, "timeout_ms": timeout_ms}
     try:
-        r = await cli.post(url, json=body)
-        data = r.json() if r.headers.get("content-type","").startswith("application/json") else {}
+        r = await cli.post(url, content=_dumps(body), headers=_JSON_HEADERS, timeout=(timeout_ms/1000.0)+2.0)
+        data = _loads(r.content) if r.headers.get("content-type","").startswith("application/json") else {}
         text = _extract_text(data)
         if r.status_code == 200 and text:
             return True, text, {"status": "200", "data": data}
@@ -98,61 +158,112 @@ async def _call_chat_prompt(cli: httpx.AsyncClient, url: str, prompt: str, max_t
     except httpx.HTTPError as e:
         return False, "", {"status": "ERR", "data": {"error": str(e)}}
 
+# Byte-identical across requests so llama-server's cache_prompt reuses its KV state;
+# keep anything per-request (sources, context, question) below it.
+_POLICY_PREFIX = (
+    "You are answering for WhatsApp in 3–6 short bullets.\n"
+    "Use ONLY the CONTEXT below. If the answer is not in the context, say: 'Not found locally.'\n"
+    "Mirror the user's language (Hindi/English). Keep it concise.\n\n"
+)
+
+async def _call_chat_stream(cli: httpx.AsyncClient, url: str, prompt: str, max_tokens: int, timeout_ms: int) -> Tuple[bool, str, Dict[str, Any]]:
+    """Same contract as _call_chat_prompt, but reads SSE from {url}/stream and cuts off at max_tokens pieces."""
+    body = {"prompt": prompt, "max_tokens": max_tokens, "timeout_ms": timeout_ms}
+    buf: List[str] = []
+    data: Dict[str, Any] = {}
+    try:
+        async with cli.stream("POST", f"{url}/stream", content=_dumps(body), headers=_JSON_HEADERS, timeout=(timeout_ms/1000.0)+2.0) as r:
+            if r.status_code != 200:
+                return False, "", {"status": str(r.status_code), "data": {"error": f"HTTP {r.status_code}"}}
+            async for line in r.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                j = _loads(line[6:])
+                if j.get("error"):
+                    # upstream broke mid-stream: the partial text is not an answer
+                    return False, "", {"status": "ERR", "data": {"error": str(j["error"])}}
+                if j.get("done"):
+                    data = j
+                    break
+                buf.append(j.get("content") or "")
+                if len(buf) >= max_tokens:
+                    break  # leaving the block closes the stream and frees the upstream slot
+    except (httpx.HTTPError, ValueError) as e:
+        return False, "", {"status": "ERR", "data": {"error": str(e)}}
+    text = "".join(buf).strip()
+    if text:
+        data["reply"] = text
+        return True, text, {"status": "200", "data": data}
+    return False, "", {"status": "200", "data": {"error": "empty stream"}}
+
+_PLAIN_PREFIX = "Answer briefly in 3–5 bullets. Mirror user language (Hindi/English).\n\nQuestion: "
+
 def _build_prompt(q: str, ctx: str, sources: List[str]) -> str:
     src_line = ""
     if sources:
-        src_line = "Sources: " + "; ".join(f"[{s}]" for s in sources[:6])
-    policy = (
-        "You are answering for WhatsApp in 3–6 short bullets.\n"
-        "Use ONLY the CONTEXT below. If the answer is not in the context, say: 'Not found locally.'\n"
-        "Mirror the user's language (Hindi/English). Keep it concise.\n"
-        f"{src_line}\n\n"
-        "CONTEXT:\n"
-        f"{ctx}\n\n"
-        f"QUESTION: {q}\n"
-        "ANSWER:"
-    )
-    return policy
+        src_line = "Sources: [" + "]; [".join(sources[:6]) + "]\n"
+    return "".join((_POLICY_PREFIX, "CONTEXT:\n", src_line, ctx, "\n\nQUESTION: ", q, "\nANSWER:"))
 
-async def _answer_with_retry(q: str, max_tokens: int, timeout_ms: int, tries: int = 3) -> Tuple[bool, str, Dict[str, Any]]:
-    # Retrieve context first (best-effort)
-    ctx, sources = await _fetch_local_context(q, timeout_ms)
-    prompt = _build_prompt(q, ctx, sources) if ctx else (
-        "Answer briefly in 3–5 bullets. Mirror user language (Hindi/English).\n\n"
-        f"Question: {q}\nAnswer:"
-    )
+def _plain_prompt(q: str) -> str:
+    return "".join((_PLAIN_PREFIX, q, "\nAnswer:"))
+
+async def _generate_with_retry(cli: httpx.AsyncClient, prompt: str, max_tokens: int, timeout_ms: int, tries: int) -> Tuple[bool, str, Dict[str, Any]]:
+    call = _call_chat_stream if WA_LLM_STREAM else _call_chat_prompt
     delay = 0.5
-    async with httpx.AsyncClient(timeout=(timeout_ms/1000.0)+2.0) as cli:
-        for i in range(1, tries+1):
-            if WA_DEBUG: log.info(f"[llm.try{i}] schema=prompt url={LLM_API_URL}")
-            ok, text, meta = await _call_chat_prompt(cli, LLM_API_URL, prompt, min(max_tokens,128), timeout_ms)
-            if ok:
-                if WA_DEBUG:
-                    d = meta.get("data", {})
-                    text_len = len(_extract_text(d))
-                    log.info(f"[llm.ok] schema=prompt elapsed_ms={d.get('elapsed_ms','?')} url={LLM_API_URL} text.len={text_len}")
-                return True, text, meta
-            if _is_retryable(meta) and i < tries:
-                if WA_DEBUG: log.warning(f"[llm.fail] schema=prompt meta={meta}; retrying in {int(delay*1000)}ms")
-                await asyncio.sleep(delay); delay *= 1.6
-                continue
-            if WA_DEBUG: log.warning(f"[llm.fail] schema=prompt meta={meta}")
-            return False, "", meta
+    for i in range(1, tries+1):
+        if WA_DEBUG: log.info(f"[llm.try{i}] schema=prompt stream={WA_LLM_STREAM} url={LLM_API_URL}")
+        ok, text, meta = await call(cli, LLM_API_URL, prompt, min(max_tokens,128), timeout_ms)
+        if ok:
+            if WA_DEBUG:
+                d = meta.get("data", {})
+                log.info(f"[llm.ok] schema=prompt elapsed_ms={d.get('elapsed_ms','?')} url={LLM_API_URL} text.len={len(text)}")
+            return True, text, meta
+        if _is_retryable(meta) and i < tries:
+            if WA_DEBUG: log.warning(f"[llm.fail] schema=prompt meta={meta}; retrying in {int(delay*1000)}ms")
+            await asyncio.sleep(delay); delay *= 1.6
+            continue
+        if WA_DEBUG: log.warning(f"[llm.fail] schema=prompt meta={meta}")
+        return False, "", meta
     return False, "", {"status": "ERR", "data": {"error": "unknown"}}
 
+async def _answer_with_retry(q: str, max_tokens: int, timeout_ms: int, tries: int = 3) -> Tuple[bool, str, Dict[str, Any]]:
+    cli = app.state.llm_client
+    # Retrieve context (best-effort) in the background
+    ctx_task = asyncio.create_task(_fetch_local_context(cli, q, timeout_ms))
+
+    if WA_LLM_STREAM and WA_SPECULATE_MS > 0 and len(q.split()) <= WA_SPECULATE_WORDS:
+        done, _ = await asyncio.wait({ctx_task}, timeout=WA_SPECULATE_MS/1000.0)
+        if not done:
+            # Slow retrieval: overlap it with the no-context answer, but only use that answer
+            # if retrieval finds nothing. Context, whenever it arrives, always wins.
+            if WA_DEBUG: log.info(f"[llm.speculate] rag>{WA_SPECULATE_MS}ms, pre-generating no-context answer")
+            plain_task = asyncio.create_task(_generate_with_retry(cli, _plain_prompt(q), max_tokens, timeout_ms, tries))
+            try:
+                ctx, sources = await ctx_task
+            except BaseException:
+                plain_task.cancel()
+                raise
+            if ctx:
+                plain_task.cancel()
+                return await _generate_with_retry(cli, _build_prompt(q, ctx, sources), max_tokens, timeout_ms, tries)
+            return await plain_task
+
+    ctx, sources = await ctx_task
+    prompt = _build_prompt(q, ctx, sources) if ctx else _plain_prompt(q)
+    return await _generate_with_retry(cli, prompt, max_tokens, timeout_ms, tries)
+
 # ---------------- Twilio ----------------
-async def twilio_send_async(to_wa: str, text: str):
+async def twilio_send_async(cli: httpx.AsyncClient, to_wa: str, text: str):
     if not _ok_twilio():
         log.warning("twilio-send skipped: missing TWILIO_* env")
         return
     url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_SID}/Messages.json"
     data = {"From": TWILIO_FROM, "To": _normalize_wa(to_wa), "Body": text}
     try:
-        async with httpx.AsyncClient(timeout=10.0, auth=(TWILIO_SID, TWILIO_TOKEN)) as cli:
-            r = await cli.post(url, data=data)
-            r.raise_for_status()
-            prev = (text or "").replace("\n", " ")[:140]
-            log.info(f"twilio-send ok to={data['To']} preview={prev}")
+        r = await cli.post(url, data=data)
+        r.raise_for_status()
+        prev = (text or "").replace("\n", " ")[:140]
+        log.info(f"twilio-send ok to={data['To']} preview={prev}")
     except Exception as e:
         log.warning(f"twilio-send error: {e}")
 
@@ -168,15 +279,17 @@ async def health():
         "ask_answer_url": ASK_ANSWER_URL,
         "debug": WA_DEBUG,
         "schema": "prompt",
+        "stream": WA_LLM_STREAM,
         "last_ok_schema": None,
+        "exact_cache": llm_cache.EXACT_CACHE_ENABLED,
+        "semantic_cache": llm_cache.semantic_enabled(),
     })
 
 @app.get("/api/llm/diag")
 async def diag(url: Optional[str] = None, timeout_ms: int = 3000):
     u = (url or LLM_API_URL)
     # simple ping using prompt schema
-    async with httpx.AsyncClient(timeout=(timeout_ms/1000.0)+1.0) as cli:
-        ok, text, meta = await _call_chat_prompt(cli, u, "Pong!", 16, timeout_ms)
+    ok, text, meta = await _call_chat_prompt(app.state.llm_client, u, "Pong!", 16, timeout_ms)
     return JSONResponse({
         "url": u, "timeout_ms": timeout_ms,
         "results": [{"attempt": "prompt", "ok": ok, "text": text[:60], "meta": {"status": meta.get("status"), "data": meta.get("data")}}]
@@ -184,24 +297,40 @@ async def diag(url: Optional[str] = None, timeout_ms: int = 3000):
 
 @app.post("/api/wa/answer")
 async def api_answer(req: Request):
-    j = await req.json()
+    j = _loads(await req.body())
     q = (j.get("q") or "").strip()
     t = int(j.get("timeout_ms") or WA_LLM_TIMEOUT_MS)
     mx = int(j.get("max_tokens") or WA_MAX_TOKENS)
+    # namespace includes the token cap, so a short cached answer never serves a longer request
+    ns = f"{WA_LANG_HINT}:{mx}"
+    t0 = perf_counter()
+    cached, tier = await llm_cache.lookup("docum_wa", q, ns)
+    if cached is not None:
+        return JSONResponse({
+            "answer": cached,
+            "elapsed_ms": int((perf_counter() - t0) * 1000),
+            "used_tokens": None,
+            "timeout_ms_used": None,
+            "max_tokens_used": None,
+            "cache": tier,
+        })
     ok, text, meta = await _answer_with_retry(q, mx, t, tries=3)
     if not ok:
         text = "LLM busy; try again."
+    else:
+        await llm_cache.store("docum_wa", q, text, ns)
     return JSONResponse({
         "answer": text,
         "elapsed_ms": meta.get("data", {}).get("elapsed_ms"),
         "used_tokens": meta.get("data", {}).get("used_tokens"),
         "timeout_ms_used": meta.get("data", {}).get("timeout_ms_used"),
         "max_tokens_used": meta.get("data", {}).get("max_tokens_used"),
+        "cache": None,
     })
 
 @app.post("/api/wa/push")
-async def api_push(req: Request):
-    j = await req.json()
+async def api_push(req: Request, bg: BackgroundTasks):
+    j = _loads(await req.body())
     to = (j.get("to") or "").strip()
     q  = (j.get("q")  or "").strip()
     t  = int(j.get("timeout_ms") or WA_LLM_TIMEOUT_MS)
@@ -210,5 +339,6 @@ async def api_push(req: Request):
     ok, text, _ = await _answer_with_retry(q, mx, t, tries=3)
     if not ok or not (text or "").strip():
         text = "LLM busy; try again."
-    await twilio_send_async(to, text)
-    return JSONResponse({"ok": True})
+    # Twilio round-trip happens after the response is sent; failures are logged by twilio_send_async
+    bg.add_task(twilio_send_async, app.state.twilio_client, to, text)
+    return JSONResponse({"ok": True, "queued": True})